@@ -18,8 +18,11 @@
 
 try: import json
 except ImportError: import simplejson as json
-import re, urllib.request, xbmc, xbmcaddon, time
+try: from orjson import loads as _loads
+except ImportError: _loads = json.loads
+import re, gzip, urllib.request, xbmc, xbmcaddon, time
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 #import web_pdb
 #web_pdb.set_trace()
 
@@ -34,6 +37,30 @@ tt_listopt = addon.getSetting('tt_list')
 result_count = int(addon.getSetting('result_count'))
 hide_europadruck = addon.getSettingBool('hide_europadruck')
 hide_wolkenfilm = addon.getSettingBool('hide_wolkenfilm')
+AGO_STR = addon.getLocalizedString(30103)
+
+# video variants to try per quality, best match first
+_VIDEO_VARIANTS = { 'X': ("h264xl", "h264m", "h264s", "adaptivestreaming"),
+                    'L': ("h264m", "h264s", "adaptivestreaming"),
+                    'M': ("h264s", "h264m", "adaptivestreaming"),
+                    'S': ("h264s", "h264m", "adaptivestreaming")
+}
+
+# image variants to try, best match first
+_IMAGE_VARIANTS = ("16x9-640", "16x9-960", "16x9-512")
+
+# -- Regular expressions ------------------------------------
+_ISO_DURATION_RE = re.compile(r'PT(\d+)M(\d+)S')
+
+# -- JSON ---------------------------------------------------
+def _fetch_json(url):
+    """Retrieves and decodes the JSON at url."""
+    request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+    with urllib.request.urlopen(request) as response:
+        body = response.read()
+        if response.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+    return _loads(body)
 
 class VideoContent(object):
     """Represents a single video or broadcast.
@@ -47,6 +74,8 @@ class VideoContent(object):
         duration: An integer representing the length of the video in seconds
         description: A String describing the video content
     """
+    __slots__ = ('tsid', 'title', 'timestamp', '_videourls', '_imageurls', 'duration', 'description')
+
     def __init__(self, tsid, title, timestamp, videourls=None, imageurls=None, duration=None, description=""):
         """Inits VideoContent with the given values."""
         self.tsid = tsid
@@ -85,44 +114,30 @@ class VideoContent(object):
         Raises:
             ValueError: If the given quality is invalid
         """
-        if (not quality in ['S', 'M', 'L', 'X']):
+        try:
+            variants = _VIDEO_VARIANTS[quality]
+        except KeyError:
             raise ValueError("quality must be one of 'S', 'M', 'L', 'X'")
 
-        videourl = None
-
-        if quality == 'X':
-            if "h264xl" in self._videourls:
-                videourl = self._videourls.get("h264xl")
-        if quality == 'L' or not videourl:
-            if "h264m" in self._videourls:
-                videourl = self._videourls.get("h264m")
-        if quality == 'M' or not videourl:
-            if "h264s" in self._videourls:
-                videourl = self._videourls.get("h264s")
-        if quality == 'S' or not videourl:
-            if "h264s" in self._videourls:
-                videourl = self._videourls.get("h264s")
-
-        #nothing found if it is a livestream
-        if videourl == None:
-            if "adaptivestreaming" in self._videourls:
-                videourl = self._videourls.get("adaptivestreaming")
-            else:
-                videourl = self._videourls
-
-        return videourl
+        # json-url results carry a plain URL String
+        if isinstance(self._videourls, dict):
+            for variant in variants:
+                videourl = self._videourls.get(variant)
+                if videourl:
+                    return videourl
+
+        return self._videourls
 
     def image_url(self):
         """Returns the URL String of the image for this video."""
-        if "16x9-640" in self._imageurls:
-            imageurl = self._imageurls.get("16x9-640")
-        elif "16x9-960" in self._imageurls:
-            imageurl = self._imageurls.get("16x9-960")
-        elif "16x9-512" in self._imageurls:
-            imageurl = self._imageurls.get("16x9-512")
-        else:
-            imageurl = self._imageurls
-        return imageurl
+        # json-url results carry a plain URL String
+        if isinstance(self._imageurls, dict):
+            for variant in _IMAGE_VARIANTS:
+                imageurl = self._imageurls.get(variant)
+                if imageurl:
+                    return imageurl
+
+        return self._imageurls
 
     def fanart_url(self):
         """Returns the URL String of the highres image for this video."""
@@ -130,35 +145,38 @@ class VideoContent(object):
 
     def __str__(self):
         """Returns a String representation for development/testing."""
-        if(self.timestamp):
-            tsformatted = self.timestamp.isoformat()
-        else:
-            tsformatted = str(None)
-        s = "VideoContent(tsid=" + self.tsid + ", title='" + self.title + "', timestamp=" + tsformatted + ", "\
-            "duration=" + str(self.duration) + ", videourl=" + str(self.video_url('L')) + ", "\
-            "imageurl=" + str(self.image_url()) + ", description='" + str(self.description) + "')"
-        return s.encode('utf-8', 'ignore')
+        tsformatted = self.timestamp.isoformat() if self.timestamp else None
+        return (f"VideoContent(tsid={self.tsid}, title='{self.title}', timestamp={tsformatted}, "
+                f"duration={self.duration}, videourl={self.video_url('L')}, "
+                f"imageurl={self.image_url()}, description='{self.description}')")
 
 
 class VideoContentParser(object):
     """Parses JSON/Python structure into VideoContent."""
 
-    def parse_video(self, jsonvideo):
-        """Parses the video JSON into a VideoContent object."""
+    def parse_video(self, jsonvideo, now=None):
+        """Parses the video JSON into a VideoContent object.
+
+        The age of the video is computed relative to now, which defaults
+        to the current time.
+        """
         tsid = jsonvideo["sophoraId"]
         timestamp = self._parse_date(jsonvideo["date"])
-        imageurls = {}
         imageurls = self._parse_image_urls(jsonvideo["teaserImage"]["imageVariants"])
         videourls = self.parse_video_urls(jsonvideo["streams"])
         duration = int(jsonvideo["tracking"][1]["length"])
 
-        age = datetime.now() - timestamp
-        if age.seconds > 3600:
-            agestr = str(age.seconds//3600) + "h " + str(age.seconds // 60 % 60) +"min"
+        if now is None:
+            now = datetime.now()
+        age = now - timestamp
+        hours, seconds = divmod(age.seconds, 3600)
+        minutes = seconds // 60
+        if hours:
+            agestr = f"{hours}h {minutes}min"
         else:
-            agestr = str(age.seconds // 60 % 60) +"min"
+            agestr = f"{minutes}min"
 
-        agostr = addon.getLocalizedString(30103)
+        agostr = AGO_STR
         if agostr == "ago":
             agostr = agestr + " " + agostr
         else:
@@ -181,7 +199,6 @@ class VideoContentParser(object):
         timestamp = self._parse_date(jsonbroadcast["date"])
         if(timestamp):
             title = title + timestamp.strftime(' vom %d.%m.%Y  %H:%M')
-        imageurls = {}
         imageurls = self._parse_image_urls(jsonbroadcast["teaserImage"]["imageVariants"])
         videourls = self.parse_video_urls(jsonbroadcast["streams"])
         duration = int(jsonbroadcast["tracking"][1]["length"])
@@ -201,7 +218,6 @@ class VideoContentParser(object):
         if( title.lower() == "tagesschau" ):
             title = title + timestamp.strftime(' vom %d.%m.%Y  %H:%M')
             
-        imageurls = {}
         imageurls = self._parse_image_urls(jsonlivestream["teaserImage"]["imageVariants"])
         videourls = self.parse_video_urls(jsonlivestream["streams"])
         duration = int(jsonlivestream["tracking"][1]["length"])
@@ -210,13 +226,13 @@ class VideoContentParser(object):
 
     def parse_video_urls(self, jsonvariants):
         """Parses the video mediadata JSON into a dict mapping variant name to URL."""
-        variants = {}
-        for name, url in list(jsonvariants.items()):
-            variants[name] = url
-        return variants
+        return dict(jsonvariants)
 
     def parse_jsonurl_result(self, entry):
-        """Parses the search result of the json-url  into a VideoContent object."""
+        """Parses the search result of the json-url  into a VideoContent object.
+
+        Returns None if the linked page contains no video.
+        """
         tsid = "0"
         title = entry["headline"]
 
@@ -230,12 +246,20 @@ class VideoContentParser(object):
         
         # Get url of mp4 stream from HTML-page
         page = urllib.request.urlopen("https://www.tagesschau.de" + entry["url"]).read()
-        found = re.search(b'<script type="application/ld\+json">(.*?"@type" : "VideoObject",.*?)</script>', page, flags=re.DOTALL)
-        data = json.loads( found[1] )
+        marker = page.find(b'"@type" : "VideoObject"')
+        if marker < 0:
+            return None
+        # cut out the ld+json script block enclosing the marker
+        start = page.rfind(b'<script type="application/ld+json">', 0, marker)
+        if start < 0:
+            return None
+        start = page.find(b'{', start)
+        end = page.find(b'</script>', marker)
+        data = _loads( page[start:end] )
         videourls = data["contentUrl"]
         imageurls = data["image"][0]["url"]
 
-        found = re.search('PT(\d+)M(\d+)S', data["duration"])
+        found = _ISO_DURATION_RE.search(data["duration"])
         duration = int(found[1]) * 60 + int(found[2])
         
         return VideoContent(tsid, title, timestamp, videourls, imageurls, duration, description)
@@ -244,16 +268,21 @@ class VideoContentParser(object):
         """Parses the given date in iso format into a datetime."""
         if(not isodate):
             return None
+        # fast path for the API's YYYY-MM-DDTHH:MM:SS prefix, time zone part is ignored
+        if( len(isodate) >= 19 and isodate[4] == isodate[7] == "-" and isodate[13] == isodate[16] == ":" ):
+            try:
+                return datetime(int(isodate[0:4]), int(isodate[5:7]), int(isodate[8:10]),
+                                int(isodate[11:13]), int(isodate[14:16]), int(isodate[17:19]))
+            except ValueError:
+                pass
+        if isodate.endswith("Z"):
+            isodate = isodate[:-1] + "+00:00"
         # ignore time zone part
-        isodate = isodate[:-6]
-        return datetime(*list(map(int, re.split('[^\d]', isodate))))
+        return datetime.fromisoformat(isodate).replace(tzinfo=None)
 
     def _parse_image_urls(self, jsonvariants):
         """Parses the image variants JSON into a dict mapping variant name to URL."""
-        variants = {}
-        for name, url in list(jsonvariants.items()):
-            variants[name] = url
-        return variants
+        return dict(jsonvariants)
 
 
 class VideoContentProvider(object):
@@ -270,8 +299,7 @@ class VideoContentProvider(object):
         """
         videos = []
 
-        url = base_url + "channels"
-        data = json.loads( urllib.request.urlopen(url).read() )
+        data = _fetch_json(base_url + "channels")
 
         for jsonstream in data["channels"]:
             video = self._parser.parse_livestream(jsonstream)
@@ -287,21 +315,21 @@ class VideoContentProvider(object):
         """
         videos = []
         
-        url = base_url + "news"
-        data = json.loads( urllib.request.urlopen(url).read() )
+        data = _fetch_json(base_url + "news")
 
+        now = datetime.now()
         for jsonvideo in data["news"]:
-            try:
-                if( (jsonvideo["type"] == "video") and (jsonvideo["tracking"][0]["src"] == "tagesschau") ):
-                    if( hide_europadruck and ("Europadruck" in jsonvideo["title"]) ):
-                        pass
-                    elif( hide_wolkenfilm and ("Wolkenfilm" in jsonvideo["title"]) ):
-                        pass
-                    else:
-                        video = self._parser.parse_video(jsonvideo)
-                        videos.append(video)
-            except:
-                pass
+            # skip hidden entries before doing any parsing work
+            title = jsonvideo.get("title", "")
+            if( (hide_europadruck and ("Europadruck" in title)) or (hide_wolkenfilm and ("Wolkenfilm" in title)) ):
+                continue
+            tracking = jsonvideo.get("tracking") or ({},)
+            if( (jsonvideo.get("type") == "video") and (tracking[0].get("src") == "tagesschau") ):
+                try:
+                    video = self._parser.parse_video(jsonvideo, now)
+                except (KeyError, IndexError, TypeError, ValueError):
+                    continue
+                videos.append(video)
 
         return videos
 
@@ -313,16 +341,15 @@ class VideoContentProvider(object):
         """
         videos = []
 
-        url = base_url + "channels"
-        data = json.loads( urllib.request.urlopen(url).read() )
+        data = _fetch_json(base_url + "channels")
 
         for jsonbroadcast in data["channels"]:
-            try:
-                if( ("date" in jsonbroadcast) and ("title" in jsonbroadcast) ):  # Filter out livestream which has no date
+            if( ("date" in jsonbroadcast) and ("title" in jsonbroadcast) ):  # Filter out livestream which has no date
+                try:
                     video = self._parser.parse_broadcast(jsonbroadcast)
-                    videos.append(video)
-            except:
-                pass
+                except (KeyError, IndexError, TypeError, ValueError):
+                    continue
+                videos.append(video)
 
         return videos
 
@@ -339,6 +366,8 @@ class VideoContentProvider(object):
             if "description" in entry:
                 if entry["description"] == "tagesschau 20:00 Uhr":
                     video = self._parser.parse_jsonurl_result(entry)
+                    if video is None:
+                        continue
                     videos.append(video)
                     
                     if len(videos) >= result_count:
@@ -354,30 +383,33 @@ class VideoContentProvider(object):
         """
         videos = []
 
-        for page in range(2):        
-            url = base_url + "search/?searchText=tagesthemen&pageSize=50&resultPage=" + str(page)
-            data = json.loads( urllib.request.urlopen(url).read() )
+        def fetch_page(page):
+            return _fetch_json(base_url + "search/?searchText=tagesthemen&pageSize=50&resultPage=" + str(page))
 
+        # fetch both result pages concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pages = list(executor.map(fetch_page, range(2)))
+
+        for data in pages:
             for jsonvideo in data["searchResults"]:
+                if( jsonvideo.get("type") != "video" ):
+                    continue
                 try:
-                    if( jsonvideo["type"] == "video" ):
-                        length = int(jsonvideo["tracking"][1]["length"])
-                        video = self._parser.parse_broadcast(jsonvideo)
-
-                        if( tt_listopt == "0" ):
-                            if( length >= 1100 ):
-                                videos.append(video)
-                        elif( tt_listopt == "1" ):
-                            if( length < 1100 ):
-                                videos.append(video)
-                        else:
-                            videos.append(video)
-                except:
-                    pass
+                    video = self._parser.parse_broadcast(jsonvideo)
+                except (KeyError, IndexError, TypeError, ValueError):
+                    continue
+
+                if( tt_listopt == "0" ):
+                    if( video.duration >= 1100 ):
+                        videos.append(video)
+                elif( tt_listopt == "1" ):
+                    if( video.duration < 1100 ):
+                        videos.append(video)
+                else:
+                    videos.append(video)
 
         return videos
 
     def search_jsonurl( self, searchstr, documentType = "video" ):
         url = base_url_json + "/search/?searchText=" + searchstr + "&documentType=" + documentType
-        data = json.loads( urllib.request.urlopen(url).read() )
-        return data
+        return _fetch_json(url)